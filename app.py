@@ -1,28 +1,129 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from flask_jwt_extended import (
-    JWTManager, create_access_token, jwt_required, get_jwt_identity
+    JWTManager, create_access_token, verify_jwt_in_request,
+    get_jwt_identity, get_jwt
 )
-from models import db, User
-from local_db import LocalDB
+from models import db, init_db, User, Note
+from local_db import LocalDB, cache
 from sync_manager import SyncManager
-from datetime import timedelta
+from datetime import datetime, timedelta
+from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import hashlib
 import os
+import sqlite3
+import time
+import orjson
+import redis
+
+
+class ORJSONProvider(JSONProvider):
+    """Serialize responses with orjson, which handles datetimes natively"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 # Initialize Flask app
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)  # Allow frontend to access backend
 
 # Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///notes.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///notes.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_pre_ping': True,
+    'pool_size': 10,
+}
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'supersecret')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 
 # Initialize extensions
 db.init_app(app)
+cache.init_app(app, config={
+    'CACHE_TYPE': 'RedisCache',
+    'CACHE_REDIS_URL': os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+})
 jwt = JWTManager(app)
 
+
+def _dispose_engine_in_child():
+    """Forked children (hashing workers, gunicorn workers) must not reuse the parent's connections"""
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_engine_in_child)
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    """WAL lets readers run alongside the writer and avoids an fsync per commit"""
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA cache_size=-64000')  # 64 MB page cache
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=268435456')  # 256 MB
+    cursor.close()
+
+
+# Token cache: sha256(Authorization header) -> user_id, expiring with the token
+redis_client = redis.Redis.from_url(
+    os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+    decode_responses=True
+)
+
+
+def _token_keys():
+    """Redis keys for the request's token: (cached identity, revocation marker)"""
+    auth_header = request.headers.get('Authorization', '')
+    digest = hashlib.sha256(auth_header.encode()).hexdigest()
+    return 'tok:' + digest, 'rev:' + digest
+
+
+def cached_jwt_required(fn):
+    """Like jwt_required(), but skips signature checks for tokens seen before.
+
+    The resolved identity is stored in g.user_id for the view to use.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key, revoked_key = _token_keys()
+        try:
+            # One round trip; revocation is checked before the cached identity
+            revoked, user_id = redis_client.mget(revoked_key, key)
+        except redis.RedisError:
+            revoked, user_id = None, None
+        if revoked is not None:
+            return jsonify({'error': 'Token has been revoked'}), 401
+
+        if user_id is None:
+            # Cache miss: verify the token once and remember it until it expires
+            verify_jwt_in_request()
+            user_id = get_jwt_identity()
+            ttl = int(get_jwt()['exp'] - time.time())
+            if ttl > 0:
+                try:
+                    redis_client.setex(key, ttl, user_id)
+                except redis.RedisError:
+                    pass
+
+        # Identities are issued as strings (JWT `sub`); notes are keyed by int
+        g.user_id = int(user_id)
+        return fn(*args, **kwargs)
+    return wrapper
+
+
 # Initialize sync manager
 sync_manager = SyncManager(api_url="http://localhost:5000/api")
 
@@ -45,7 +146,7 @@ def register():
     db.session.add(user)
     db.session.commit()
 
-    token = create_access_token(identity=user.id)
+    token = create_access_token(identity=str(user.id))
     return jsonify({'message': 'Registered successfully', 'token': token, 'user': user.to_dict()}), 201
 
 
@@ -60,34 +161,116 @@ def login():
     if not user or not user.check_password(password):
         return jsonify({'error': 'Invalid credentials'}), 401
 
-    token = create_access_token(identity=user.id)
+    # check_password may have upgraded the stored hash
+    if db.session.is_modified(user):
+        db.session.commit()
+
+    token = create_access_token(identity=str(user.id))
     return jsonify({'message': 'Login successful', 'token': token, 'user': user.to_dict()}), 200
 
 
+@app.route('/api/logout', methods=['POST'])
+@cached_jwt_required
+def logout():
+    """Logout user by revoking the token until it expires"""
+    # The identity may have come from the cache, so read exp from the token
+    verify_jwt_in_request()
+    ttl = int(get_jwt()['exp'] - time.time())
+    key, revoked_key = _token_keys()
+    try:
+        with redis_client.pipeline() as pipe:
+            if ttl > 0:
+                pipe.setex(revoked_key, ttl, 1)
+            pipe.delete(key)
+            pipe.execute()
+    except redis.RedisError:
+        return jsonify({'error': 'Logout unavailable, try again'}), 503
+    return jsonify({'message': 'Logged out'}), 200
+
+
 # ---------- Notes CRUD ----------
+def _make_etag(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def _not_modified(etag):
+    """Return a 304 response if the client already holds this representation"""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = app.response_class(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def _json_with_etag(payload, etag):
+    response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    return response, 200
+
+
+# Columns needed by the frontend's list view; skips the note content.
+# Tags are a relationship and are loaded separately via selectin.
+LIST_VIEW_COLUMNS = [Note.id, Note.title, Note.updated_at, Note.version]
+
+
 @app.route('/api/notes', methods=['GET'])
-@jwt_required()
+@cached_jwt_required
 def get_notes():
-    user_id = get_jwt_identity()
+    user_id = g.user_id
+
+    # Sync clients ask for {id, version} pairs first, then only the bodies they miss
+    if request.args.get('ids_only') == '1':
+        since = request.args.get('since')
+        try:
+            since = datetime.fromisoformat(since) if since else None
+        except ValueError:
+            return jsonify({'error': 'Invalid since timestamp'}), 400
+        etag = _make_etag(user_id, request.query_string, LocalDB.get_notes_stamp(user_id))
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+        return _json_with_etag(LocalDB.get_note_versions(user_id, since), etag)
+
+    ids = request.args.get('ids')
+    if ids:
+        try:
+            note_ids = [int(note_id) for note_id in ids.split(',')]
+        except ValueError:
+            return jsonify({'error': 'Invalid ids'}), 400
+        return jsonify(LocalDB.get_notes_by_ids(user_id, note_ids)), 200
+
     search = request.args.get('search')
-    notes = LocalDB.get_notes(user_id, search)
-    return jsonify(notes), 200
+    columns = LIST_VIEW_COLUMNS if request.args.get('view') == 'list' else None
+
+    # Answer 304 before touching rows when nothing has changed
+    stamp = LocalDB.get_notes_stamp(user_id)
+    etag = _make_etag(user_id, request.query_string, stamp)
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
+    notes = LocalDB.get_notes(user_id, search, columns=columns, stamp=stamp)
+    return _json_with_etag(notes, etag)
 
 
 @app.route('/api/notes/<int:note_id>', methods=['GET'])
-@jwt_required()
+@cached_jwt_required
 def get_note(note_id):
-    user_id = get_jwt_identity()
+    user_id = g.user_id
     note = LocalDB.get_note(note_id, user_id)
     if not note:
         return jsonify({'error': 'Note not found'}), 404
-    return jsonify(note), 200
+    etag = _make_etag(user_id, note_id, note['version'], note['updated_at'])
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    return _json_with_etag(note, etag)
 
 
 @app.route('/api/notes', methods=['POST'])
-@jwt_required()
+@cached_jwt_required
 def create_note():
-    user_id = get_jwt_identity()
+    user_id = g.user_id
     data = request.get_json()
     title = data.get('title')
     content = data.get('content')
@@ -99,9 +282,9 @@ def create_note():
 
 
 @app.route('/api/notes/<int:note_id>', methods=['PUT'])
-@jwt_required()
+@cached_jwt_required
 def update_note(note_id):
-    user_id = get_jwt_identity()
+    user_id = g.user_id
     data = request.get_json()
     version = data.get('version')
     current = LocalDB.get_note(note_id, user_id)
@@ -118,9 +301,9 @@ def update_note(note_id):
 
 
 @app.route('/api/notes/<int:note_id>', methods=['DELETE'])
-@jwt_required()
+@cached_jwt_required
 def delete_note(note_id):
-    user_id = get_jwt_identity()
+    user_id = g.user_id
     if not LocalDB.delete_note(note_id, user_id):
         return jsonify({'error': 'Note not found'}), 404
     return jsonify({'message': 'Note deleted'}), 200
@@ -138,12 +321,12 @@ def create_tables_once():
     """Create database tables only once (Flask 3.x compatible)"""
     if not hasattr(app, "_db_created"):
         with app.app_context():
-            db.create_all()
+            init_db()
             app._db_created = True
 
 
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        init_db()
     app.run(debug=True, host='0.0.0.0', port=5000)
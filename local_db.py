@@ -1,6 +1,104 @@
-from models import db, Note
+from models import db, Note, Tag, note_tags
 from datetime import datetime
-from sqlalchemy import or_
+from threading import Event
+from flask_caching import Cache
+from sqlalchemy import or_, select, func, text, update, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import load_only
+
+cache = Cache()
+
+# Set on every local write; the SyncManager thread waits on it. A flag
+# rather than a queue, so nothing accumulates when no sync loop is running
+notes_changed = Event()
+
+
+def mark_dirty():
+    """Wake the sync thread because a note needs pushing"""
+    notes_changed.set()
+
+
+def _fts_query(search_query):
+    """Turn free text into an FTS5 query of quoted prefix terms"""
+    terms = search_query.split()
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+# Notes list statements, built once and reused with bound parameters so
+# each request skips expression construction and hits the compiled cache
+_NOTES_STMT = (
+    select(Note)
+    .where(Note.user_id == bindparam('uid'), Note.is_deleted == False)
+    .order_by(Note.updated_at.desc())
+)
+
+# Exact tag names go through the unique index on tags.name
+_TAG_MATCH = Note.tags.any(Tag.name.in_(bindparam('tags', expanding=True)))
+
+# SQLite: title/content served by the notes_fts index created in init_db
+_FTS_SEARCH_STMT = _NOTES_STMT.where(or_(
+    Note.id.in_(
+        text("SELECT rowid FROM notes_fts WHERE notes_fts MATCH :q")
+        .columns(rowid=db.Integer)
+    ),
+    _TAG_MATCH
+))
+
+# Other dialects: substring match
+_ILIKE_SEARCH_STMT = _NOTES_STMT.where(or_(
+    Note.title.ilike(bindparam('q')),
+    Note.content.ilike(bindparam('q')),
+    _TAG_MATCH
+))
+
+
+# Dialect INSERT constructs that support ON CONFLICT DO NOTHING
+_UPSERT_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def _resolve_tags(names):
+    """Return Tag rows for the given names, creating any that don't exist"""
+    names = list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+    if not names:
+        return []
+    # Let the unique index settle concurrent creates of the same name,
+    # then re-select so both writers link to whichever row won
+    insert = _UPSERT_INSERTS[db.engine.dialect.name]
+    db.session.execute(
+        insert(Tag)
+        .values([{'name': name} for name in names])
+        .on_conflict_do_nothing(index_elements=['name'])
+    )
+    tags = {tag.name: tag for tag in Tag.query.filter(Tag.name.in_(names))}
+    return [tags[name] for name in names]
+
+
+@cache.memoize(timeout=60)
+def _get_notes_cached(user_id, search_query, stamp, column_names=None):
+    """Run the notes list query; `stamp` only varies the cache key"""
+    params = {'uid': user_id}
+    
+    if search_query and search_query.strip():
+        params['tags'] = search_query.split()
+        if db.engine.dialect.name == 'sqlite':
+            stmt = _FTS_SEARCH_STMT
+            params['q'] = _fts_query(search_query)
+        else:
+            stmt = _ILIKE_SEARCH_STMT
+            params['q'] = f"%{search_query}%"
+    else:
+        stmt = _NOTES_STMT
+    
+    if column_names:
+        stmt = stmt.options(
+            load_only(*(getattr(Note, name) for name in column_names))
+        )
+    
+    notes = db.session.execute(stmt, params).scalars().all()
+    if column_names:
+        return [note.to_list_dict() for note in notes]
+    return [note.to_dict() for note in notes]
+
 
 class LocalDB:
     """Handles local SQLite CRUD operations"""
@@ -13,100 +111,206 @@ class LocalDB:
                 user_id=user_id,
                 title=title,
                 content=content,
-                tags=','.join(tags) if tags else '',
+                tags=_resolve_tags(tags or []),
                 version=1
             )
             db.session.add(note)
             db.session.commit()
+            mark_dirty()
             return note.to_dict()
         except Exception as e:
             db.session.rollback()
             raise Exception(f"Failed to create note: {str(e)}")
     
     @staticmethod
-    def get_notes(user_id, search_query=None):
-        """Retrieve all notes for a user with optional search"""
+    def get_notes_stamp(user_id):
+        """Cheap fingerprint of all of a user's notes, deleted ones included
+
+        Local edits and deletes bump updated_at, pulled notes change the
+        row count and recorded server IDs change COUNT(server_id), so the
+        stamp changes whenever anything in Note.to_dict output does.
+        """
+        return tuple(db.session.execute(
+            select(
+                func.max(Note.updated_at),
+                func.max(Note.version),
+                func.count(Note.id),
+                func.count(Note.server_id)
+            ).where(Note.user_id == user_id)
+        ).one())
+    
+    @staticmethod
+    def get_notes(user_id, search_query=None, columns=None, stamp=None):
+        """Retrieve all notes for a user with optional search
+
+        When `columns` is given only those columns are loaded and the
+        notes are returned in list form (see Note.to_list_dict). Pass a
+        `stamp` from get_notes_stamp to avoid probing twice.
+        """
         try:
-            query = Note.query.filter_by(user_id=user_id, is_deleted=False)
-            
-            if search_query:
-                search = f"%{search_query}%"
-                query = query.filter(
-                    or_(
-                        Note.title.ilike(search),
-                        Note.content.ilike(search),
-                        Note.tags.ilike(search)
-                    )
-                )
-            
-            notes = query.order_by(Note.updated_at.desc()).all()
-            return [note.to_dict() for note in notes]
+            if stamp is None:
+                stamp = LocalDB.get_notes_stamp(user_id)
+            # Column names rather than attributes keep the memoize key stable
+            column_names = tuple(column.key for column in columns) if columns else None
+            return _get_notes_cached(user_id, search_query, stamp, column_names)
         except Exception as e:
             raise Exception(f"Failed to retrieve notes: {str(e)}")
     
     @staticmethod
-    def get_note(note_id, user_id):
-        """Get a specific note by ID"""
-        try:
-            note = Note.query.filter_by(
-                id=note_id, 
-                user_id=user_id, 
-                is_deleted=False
-            ).first()
-            return note.to_dict() if note else None
-        except Exception as e:
-            raise Exception(f"Failed to retrieve note: {str(e)}")
+    def get_note_versions(user_id, since=None):
+        """Return {id, version, updated_at} for notes changed after `since`"""
+        stmt = select(Note.id, Note.version, Note.updated_at).where(Note.user_id == user_id)
+        if since is not None:
+            stmt = stmt.where(Note.updated_at > since)
+        rows = db.session.execute(stmt).all()
+        return [
+            {'id': row.id, 'version': row.version, 'updated_at': row.updated_at}
+            for row in rows
+        ]
     
     @staticmethod
-    def update_note(note_id, user_id, title=None, content=None, tags=None):
-        """Update an existing note"""
+    def get_notes_by_ids(user_id, note_ids):
+        """Retrieve the given notes for a user in a single query"""
+        notes = Note.query.filter(
+            Note.user_id == user_id,
+            Note.is_deleted == False,
+            Note.id.in_(note_ids)
+        ).all()
+        return [note.to_dict() for note in notes]
+    
+    @staticmethod
+    def get_server_ids(user_id):
+        """Return the server IDs of a user's local notes, including deleted ones"""
+        return set(db.session.execute(
+            select(Note.server_id).where(
+                Note.user_id == user_id,
+                Note.server_id.is_not(None)
+            )
+        ).scalars())
+    
+    @staticmethod
+    def set_server_ids(server_ids):
+        """Record {local note ID: server ID} for notes the server just created"""
+        if not server_ids:
+            return
+        table = Note.__table__
         try:
-            note = Note.query.filter_by(
-                id=note_id, 
-                user_id=user_id, 
-                is_deleted=False
-            ).first()
-            
-            if not note:
-                return None
-            
-            if title is not None:
-                note.title = title
-            if content is not None:
-                note.content = content
-            if tags is not None:
-                note.tags = ','.join(tags) if tags else ''
-            
-            note.updated_at = datetime.utcnow()
-            note.version += 1  # Increment version for conflict detection
-            
+            db.session.execute(
+                update(table)
+                .where(table.c.id == bindparam('note_id'))
+                # Keep updated_at as-is so onupdate doesn't re-dirty the notes
+                .values(server_id=bindparam('new_server_id'), updated_at=table.c.updated_at),
+                [
+                    {'note_id': note_id, 'new_server_id': server_id}
+                    for note_id, server_id in server_ids.items()
+                ]
+            )
             db.session.commit()
-            return note.to_dict()
         except Exception as e:
             db.session.rollback()
-            raise Exception(f"Failed to update note: {str(e)}")
+            raise Exception(f"Failed to record server IDs: {str(e)}")
     
     @staticmethod
-    def delete_note(note_id, user_id):
-        """Soft delete a note (for sync purposes)"""
+    def bulk_create_notes(user_id, notes):
+        """Insert server notes locally in one commit, recording their server IDs"""
+        if not notes:
+            return
         try:
-            note = Note.query.filter_by(
-                id=note_id, 
-                user_id=user_id
-            ).first()
+            mappings = []
+            for note in notes:
+                updated_at = datetime.fromisoformat(note['updated_at'])
+                mappings.append({
+                    'server_id': note['id'],
+                    'user_id': user_id,
+                    'title': note['title'],
+                    'content': note['content'],
+                    'created_at': datetime.fromisoformat(note['created_at']),
+                    'updated_at': updated_at,
+                    'synced_at': updated_at,  # Already matches the server copy
+                    'version': note['version'],
+                })
+            db.session.bulk_insert_mappings(Note, mappings)
             
-            if not note:
-                return False
-            
-            note.is_deleted = True
-            note.updated_at = datetime.utcnow()
-            note.version += 1
+            # Local IDs for the new rows, to link their tags
+            local_ids = dict(db.session.execute(
+                select(Note.server_id, Note.id).where(
+                    Note.user_id == user_id,
+                    Note.server_id.in_([note['id'] for note in notes])
+                )
+            ).all())
             
+            tags = _resolve_tags(
+                name for note in notes for name in note.get('tags') or []
+            )
+            tag_ids = {tag.name: tag.id for tag in tags}
+            links = {
+                (local_ids[note['id']], tag_ids[name.strip()])
+                for note in notes
+                for name in note.get('tags') or []
+                if name and name.strip()
+            }
+            if links:
+                db.session.execute(note_tags.insert(), [
+                    {'note_id': note_id, 'tag_id': tag_id} for note_id, tag_id in links
+                ])
             db.session.commit()
-            return True
         except Exception as e:
             db.session.rollback()
-            raise Exception(f"Failed to delete note: {str(e)}")
+            raise Exception(f"Failed to bulk create notes: {str(e)}")
+    
+    @staticmethod
+    def _get_owned_note(note_id, user_id):
+        """Primary-key lookup through the session identity map"""
+        note = db.session.get(Note, note_id)
+        if note is None or note.user_id != user_id:
+            return None
+        return note
+    
+    @staticmethod
+    def get_note(note_id, user_id):
+        """Get a specific note by ID"""
+        note = LocalDB._get_owned_note(note_id, user_id)
+        if not note or note.is_deleted:
+            return None
+        return note.to_dict()
+    
+    @staticmethod
+    def update_note(note_id, user_id, title=None, content=None, tags=None):
+        """Update an existing note"""
+        note = LocalDB._get_owned_note(note_id, user_id)
+        
+        if not note or note.is_deleted:
+            return None
+        
+        if title is not None:
+            note.title = title
+        if content is not None:
+            note.content = content
+        if tags is not None:
+            note.tags = _resolve_tags(tags)
+        
+        note.updated_at = datetime.utcnow()
+        note.version += 1  # Increment version for conflict detection
+        
+        db.session.commit()
+        mark_dirty()
+        return note.to_dict()
+    
+    @staticmethod
+    def delete_note(note_id, user_id):
+        """Soft delete a note (for sync purposes)"""
+        note = LocalDB._get_owned_note(note_id, user_id)
+        
+        if not note:
+            return False
+        
+        note.is_deleted = True
+        note.updated_at = datetime.utcnow()
+        note.version += 1
+        
+        db.session.commit()
+        mark_dirty()
+        return True
     
     @staticmethod
     def get_unsynced_notes(user_id):
@@ -124,13 +328,32 @@ class LocalDB:
             raise Exception(f"Failed to get unsynced notes: {str(e)}")
     
     @staticmethod
-    def mark_synced(note_id):
-        """Mark a note as successfully synced"""
+    def mark_synced(pushed):
+        """Mark notes as synced, given (note ID, pushed version) pairs
+
+        Rows are only stamped if their version still matches what was pushed,
+        so edits made while the push was in flight stay unsynced. Runs as a
+        single executemany UPDATE and one commit.
+        """
+        if not pushed:
+            return
+        table = Note.__table__
+        synced_at = datetime.utcnow()
         try:
-            note = Note.query.get(note_id)
-            if note:
-                note.synced_at = datetime.utcnow()
-                db.session.commit()
+            db.session.execute(
+                update(table)
+                .where(
+                    table.c.id == bindparam('note_id'),
+                    table.c.version == bindparam('pushed_version')
+                )
+                # Keep updated_at as-is so onupdate doesn't re-dirty the notes
+                .values(synced_at=synced_at, updated_at=table.c.updated_at),
+                [
+                    {'note_id': note_id, 'pushed_version': version}
+                    for note_id, version in pushed
+                ]
+            )
+            db.session.commit()
         except Exception as e:
             db.session.rollback()
             raise Exception(f"Failed to mark note as synced: {str(e)}")
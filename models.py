@@ -1,8 +1,145 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from threading import Lock
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import text
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+from werkzeug.security import check_password_hash
 
 db = SQLAlchemy()
+password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
+
+# Password hashing is CPU-bound; run it in worker processes so it never
+# holds the GIL (or blocks the gevent hub) on a request-serving thread
+password_executor = ProcessPoolExecutor(max_workers=2)
+_password_executor_lock = Lock()
+
+
+def _hash_password(password):
+    return password_hasher.hash(password)
+
+
+def _verify_password(password_hash, password):
+    """Return (matches, new_hash); new_hash is set when the hash should be upgraded"""
+    if not password_hash.startswith('$argon2'):
+        # Werkzeug pbkdf2/scrypt hash from before the switch to Argon2
+        if not check_password_hash(password_hash, password):
+            return False, None
+        return True, password_hasher.hash(password)
+    
+    try:
+        password_hasher.verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False, None
+    
+    if password_hasher.check_needs_rehash(password_hash):
+        return True, password_hasher.hash(password)
+    return True, None
+
+
+def _run_password_task(fn, *args):
+    """Run fn in password_executor, replacing the pool if a worker has died
+
+    A killed worker (OOM, signal) breaks the pool for good; the failed call
+    runs inline and the next one gets a fresh pool.
+    """
+    global password_executor
+    executor = password_executor
+    try:
+        return executor.submit(fn, *args).result()
+    except BrokenProcessPool:
+        with _password_executor_lock:
+            if password_executor is executor:
+                password_executor = ProcessPoolExecutor(max_workers=2)
+                executor.shutdown(wait=False)
+        return fn(*args)
+
+
+# SQLite FTS5 index over note text, kept in sync with `notes` by triggers.
+# Tags are matched through the indexed `tags` table instead.
+NOTES_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+        title, content,
+        content='notes', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN
+        INSERT INTO notes_fts(rowid, title, content)
+        VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    # Re-index only when indexed text changes, not on sync/version bookkeeping.
+    # Dropped first so databases with the older every-column trigger pick this up.
+    """DROP TRIGGER IF EXISTS notes_fts_au""",
+    """CREATE TRIGGER notes_fts_au AFTER UPDATE OF title, content ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO notes_fts(rowid, title, content)
+        VALUES (new.id, new.title, new.content);
+    END""",
+]
+
+
+def init_db():
+    """Create all tables and bring databases from older releases up to date"""
+    db.create_all()
+    with db.engine.begin() as conn:
+        if db.engine.dialect.name == 'sqlite':
+            _upgrade_sqlite(conn)
+        _create_missing_indexes(conn)
+
+
+def _upgrade_sqlite(conn):
+    """Full-text search index plus in-place column and data migrations"""
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = 'notes_fts'")
+    ).first()
+    for statement in NOTES_FTS_DDL:
+        conn.execute(text(statement))
+    if not exists:
+        # Index notes written before the FTS table existed
+        conn.execute(text("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')"))
+    _migrate_server_id(conn)
+    _migrate_legacy_tags(conn)
+
+
+def _create_missing_indexes(conn):
+    """create_all() skips indexes on tables that already exist, so add them here"""
+    for index in Note.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _migrate_server_id(conn):
+    """Add notes.server_id to databases created before it existed"""
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info(notes)"))}
+    if 'server_id' in columns:
+        return
+    conn.execute(text("ALTER TABLE notes ADD COLUMN server_id INTEGER"))
+
+
+def _migrate_legacy_tags(conn):
+    """Copy comma-separated notes.tags values from older databases into note_tags"""
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info(notes)"))}
+    if 'tags' not in columns:
+        return
+    if conn.execute(text("SELECT 1 FROM note_tags LIMIT 1")).first():
+        return
+    
+    rows = conn.execute(text(
+        "SELECT id, tags FROM notes WHERE tags IS NOT NULL AND tags != ''"
+    )).all()
+    for note_id, tags in rows:
+        for name in {name.strip() for name in tags.split(',') if name.strip()}:
+            conn.execute(text("INSERT OR IGNORE INTO tags (name) VALUES (:name)"), {'name': name})
+            conn.execute(text(
+                "INSERT OR IGNORE INTO note_tags (note_id, tag_id) "
+                "SELECT :note_id, id FROM tags WHERE name = :name"
+            ), {'note_id': note_id, 'name': name})
+
 
 class User(db.Model):
     """User model for authentication"""
@@ -18,11 +155,16 @@ class User(db.Model):
     
     def set_password(self, password):
         """Hash and store password securely"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = _run_password_task(_hash_password, password)
     
     def check_password(self, password):
-        """Verify password against hash"""
-        return check_password_hash(self.password_hash, password)
+        """Verify password against hash, upgrading legacy hashes on success"""
+        matches, new_hash = _run_password_task(
+            _verify_password, self.password_hash, password
+        )
+        if new_hash:
+            self.password_hash = new_hash
+        return matches
     
     def to_dict(self):
         return {
@@ -32,6 +174,21 @@ class User(db.Model):
         }
 
 
+note_tags = db.Table(
+    'note_tags',
+    db.Column('note_id', db.Integer, db.ForeignKey('notes.id'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tags.id'), primary_key=True, index=True)
+)
+
+
+class Tag(db.Model):
+    """Tag shared across notes"""
+    __tablename__ = 'tags'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False, index=True)
+
+
 class Note(db.Model):
     """Note model with sync tracking"""
     __tablename__ = 'notes'
@@ -40,7 +197,7 @@ class Note(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    tags = db.Column(db.String(500))  # Comma-separated tags
+    tags = db.relationship('Tag', secondary=note_tags, lazy='selectin')
     
     # Sync tracking fields
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -48,16 +205,42 @@ class Note(db.Model):
     synced_at = db.Column(db.DateTime)  # Last successful sync
     version = db.Column(db.Integer, default=1)  # For conflict resolution
     is_deleted = db.Column(db.Boolean, default=False)  # Soft delete for sync
+    server_id = db.Column(db.Integer)  # ID of this note on the sync server, once known
+    
+    __table_args__ = (
+        # Serves the live-notes list ordered by updated_at
+        db.Index(
+            'ix_notes_user_active_updated',
+            'user_id', 'is_deleted', updated_at.desc(),
+            postgresql_where=text('is_deleted = false')
+        ),
+        # Covers both branches of the get_unsynced_notes filter
+        db.Index('ix_notes_unsynced', 'user_id', 'synced_at', 'updated_at'),
+        # Server IDs are only unique within one user's notes
+        db.Index('ux_notes_user_server', 'user_id', 'server_id', unique=True),
+    )
     
     def to_dict(self):
+        """Datetimes are left for orjson to serialize"""
         return {
             'id': self.id,
             'user_id': self.user_id,
             'title': self.title,
             'content': self.content,
-            'tags': self.tags.split(',') if self.tags else [],
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat(),
+            'tags': [tag.name for tag in self.tags],
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
             'version': self.version,
-            'is_deleted': self.is_deleted
+            'is_deleted': self.is_deleted,
+            'server_id': self.server_id
+        }
+    
+    def to_list_dict(self):
+        """List-view form without content, safe to use with load_only()"""
+        return {
+            'id': self.id,
+            'title': self.title,
+            'tags': [tag.name for tag in self.tags],
+            'updated_at': self.updated_at,
+            'version': self.version
         }
@@ -1,32 +1,57 @@
-import requests
+import asyncio
+import httpx
+import jwt
+import orjson
 import time
+from datetime import datetime
 from threading import Thread, Event
-from local_db import LocalDB
+from urllib.parse import urlparse
+from local_db import LocalDB, notes_changed
+
+# Server note bodies fetched per `?ids=` request, keeping the URL well
+# under common request-line limits (Gunicorn's default is 4094 bytes)
+PULL_BATCH_SIZE = 100
 
 class SyncManager:
     """Manages synchronization between local and remote databases"""
     
-    def __init__(self, api_url, check_interval=30):
+    def __init__(self, api_url, check_interval=30, max_in_flight=8):
         self.api_url = api_url
         self.check_interval = check_interval
+        self.max_in_flight = max_in_flight
+        
+        # Host and port for the TCP reachability probe
+        parsed = urlparse(api_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        
         self.is_online = False
         self.sync_thread = None
         self.stop_event = Event()
+        self.notes_changed = notes_changed
         self.auth_token = None
+        self.user_id = None
+        self.last_pull_at = None  # Server-side updated_at watermark (ISO string)
+        self.last_pull_etag = None
+        self.client = None  # httpx.AsyncClient, owned by the sync thread's event loop
     
     def set_auth_token(self, token):
         """Set JWT token for authenticated requests"""
         self.auth_token = token
+        # The server verifies the signature; we only need the identity claim
+        claims = jwt.decode(token, options={'verify_signature': False})
+        self.user_id = int(claims['sub'])
     
-    def check_connectivity(self):
-        """Check if we can reach the remote server"""
+    async def check_connectivity(self):
+        """Check if we can reach the remote server with a bare TCP connect"""
         try:
-            response = requests.get(
-                f"{self.api_url}/health",
-                timeout=5
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), timeout=2
             )
-            return response.status_code == 200
-        except:
+            writer.close()
+            await writer.wait_closed()
+            return True
+        except (OSError, asyncio.TimeoutError):
             return False
     
     def start_sync_loop(self):
@@ -35,33 +60,60 @@ class SyncManager:
             return
         
         self.stop_event.clear()
-        self.sync_thread = Thread(target=self._sync_loop, daemon=True)
+        self.sync_thread = Thread(
+            target=lambda: asyncio.run(self._sync_loop()), daemon=True
+        )
         self.sync_thread.start()
     
     def stop_sync_loop(self):
         """Stop background sync thread"""
         self.stop_event.set()
+        self.notes_changed.set()  # Wake the thread so it sees the stop flag
         if self.sync_thread:
             self.sync_thread.join(timeout=5)
     
-    def _sync_loop(self):
-        """Background thread that periodically syncs data"""
-        while not self.stop_event.is_set():
-            was_online = self.is_online
-            self.is_online = self.check_connectivity()
-            
-            # If we just came back online, sync immediately
-            if self.is_online and not was_online:
-                print("✅ Back online! Starting sync...")
-                self.sync_all()
-            elif self.is_online:
-                # Regular sync when online
-                self.sync_all()
-            
-            # Wait before next check
-            self.stop_event.wait(self.check_interval)
+    async def _sync_loop(self):
+        """Event loop that syncs on local writes or every check_interval"""
+        # One keep-alive client for the life of the loop; HTTP/2 multiplexes
+        # concurrent pushes over a single connection when the server offers it
+        transport = httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=3,
+            limits=httpx.Limits(max_keepalive_connections=8)
+        )
+        async with httpx.AsyncClient(
+            base_url=self.api_url, transport=transport, timeout=10
+        ) as self.client:
+            while not self.stop_event.is_set():
+                # Wait for a note to be written locally or the heartbeat to expire
+                woken = await asyncio.to_thread(
+                    self.notes_changed.wait, self.check_interval
+                )
+                # Clear before syncing: sync_all re-reads unsynced rows, so
+                # writes landing after this point simply set the flag again
+                self.notes_changed.clear()
+                
+                if self.stop_event.is_set():
+                    break
+                
+                # A single sync_all covers every pending write; skip the
+                # health probe when we already know the server is reachable
+                if woken and self.is_online:
+                    await self.sync_all()
+                    continue
+                
+                was_online = self.is_online
+                self.is_online = await self.check_connectivity()
+                
+                # If we just came back online, sync immediately
+                if self.is_online and not was_online:
+                    print("✅ Back online! Starting sync...")
+                    await self.sync_all()
+                elif self.is_online:
+                    # Regular sync when online
+                    await self.sync_all()
     
-    def sync_all(self):
+    async def sync_all(self):
         """Sync all unsynced notes with the server"""
         if not self.is_online or not self.auth_token:
             return
@@ -70,43 +122,68 @@ class SyncManager:
             user_id = self._get_user_id_from_token()
             unsynced_notes = LocalDB.get_unsynced_notes(user_id)
             
-            headers = {'Authorization': f'Bearer {self.auth_token}'}
+            headers = {
+                'Authorization': f'Bearer {self.auth_token}',
+                'Content-Type': 'application/json'
+            }
             
-            for note in unsynced_notes:
-                try:
-                    # Try to sync this note
-                    if note['id'] > 0:  # Existing note
-                        response = requests.put(
-                            f"{self.api_url}/notes/{note['id']}",
-                            json=note,
-                            headers=headers,
-                            timeout=10
-                        )
-                    else:  # New note
-                        response = requests.post(
-                            f"{self.api_url}/notes",
-                            json=note,
-                            headers=headers,
-                            timeout=10
-                        )
-                    
-                    if response.status_code == 200:
-                        # Successfully synced
-                        LocalDB.mark_synced(note['id'])
-                    elif response.status_code == 409:
-                        # Conflict detected
-                        self._handle_conflict(note, response.json())
-                
-                except requests.RequestException as e:
-                    print(f"❌ Failed to sync note {note['id']}: {str(e)}")
+            # Push notes concurrently, at most max_in_flight at a time
+            limiter = asyncio.Semaphore(self.max_in_flight)
+            
+            async def push(note):
+                async with limiter:
+                    return await self._sync_one(note, headers)
+            
+            responses = await asyncio.gather(
+                *(push(note) for note in unsynced_notes),
+                return_exceptions=True
+            )
+            
+            synced = []  # (note ID, pushed version)
+            new_server_ids = {}
+            for note, response in zip(unsynced_notes, responses):
+                if isinstance(response, httpx.HTTPError):
+                    print(f"❌ Failed to sync note {note['id']}: {str(response)}")
                     continue
+                if isinstance(response, BaseException):
+                    raise response
+                
+                if response.status_code == 200:
+                    # Successfully synced
+                    synced.append((note['id'], note['version']))
+                elif response.status_code == 201:
+                    # Created on the server; remember its ID for later pushes
+                    new_server_ids[note['id']] = response.json()['id']
+                    synced.append((note['id'], note['version']))
+                elif response.status_code == 409:
+                    # Conflict detected
+                    self._handle_conflict(note, response.json())
+            
+            # One UPDATE and commit for the whole cycle
+            LocalDB.set_server_ids(new_server_ids)
+            LocalDB.mark_synced(synced)
             
             # Pull any new notes from server
-            self._pull_from_server(user_id, headers)
+            await self._pull_from_server(user_id, headers)
         
         except Exception as e:
             print(f"❌ Sync failed: {str(e)}")
     
+    async def _sync_one(self, note, headers):
+        """Push a single note to the server"""
+        if note['server_id']:  # Existing note
+            return await self.client.put(
+                f"/notes/{note['server_id']}",
+                content=orjson.dumps(note),
+                headers=headers
+            )
+        # New note
+        return await self.client.post(
+            "/notes",
+            content=orjson.dumps(note),
+            headers=headers
+        )
+    
     def _handle_conflict(self, local_note, server_response):
         """Handle sync conflicts between local and server notes"""
         server_note = server_response.get('note')
@@ -135,34 +212,63 @@ class SyncManager:
         )
         self._accept_server_version(server_note)
     
-    def _pull_from_server(self, user_id, headers):
+    async def _pull_from_server(self, user_id, headers):
         """Pull any new notes from server that are missing locally"""
         try:
-            response = requests.get(
-                f"{self.api_url}/notes",
-                headers=headers,
-                timeout=10
+            params = {'ids_only': 1}
+            if self.last_pull_at:
+                params['since'] = self.last_pull_at
+            
+            # Only IDs and versions of notes changed since the last pull;
+            # the server answers 304 when nothing has changed at all
+            pull_headers = dict(headers)
+            if self.last_pull_etag:
+                pull_headers['If-None-Match'] = self.last_pull_etag
+            response = await self.client.get(
+                "/notes",
+                params=params,
+                headers=pull_headers
             )
+            if response.status_code != 200:
+                return
             
-            if response.status_code == 200:
-                server_notes = response.json()
-                local_notes = LocalDB.get_notes(user_id)
-                local_ids = {note['id'] for note in local_notes}
-                
-                for server_note in server_notes:
-                    if server_note['id'] not in local_ids:
-                        LocalDB.create_note(
-                            user_id=user_id,
-                            title=server_note['title'],
-                            content=server_note['content'],
-                            tags=server_note.get('tags', [])
-                        )
+            changes = response.json()
+            self.last_pull_etag = response.headers.get('ETag')
+            if not changes:
+                # Keep the same `since` so the next request can match the ETag
+                return
+            
+            known_ids = LocalDB.get_server_ids(user_id)
+            missing_ids = [
+                entry['id'] for entry in changes
+                if entry['id'] not in known_ids
+            ]
+            
+            # Fetch missing bodies in bounded batches, then insert them together
+            missing_notes = []
+            for start in range(0, len(missing_ids), PULL_BATCH_SIZE):
+                batch = missing_ids[start:start + PULL_BATCH_SIZE]
+                response = await self.client.get(
+                    "/notes",
+                    params={'ids': ','.join(str(note_id) for note_id in batch)},
+                    headers=headers
+                )
+                if response.status_code != 200:
+                    return
+                missing_notes.extend(response.json())
+            LocalDB.bulk_create_notes(user_id, missing_notes)
+            
+            # Watermark from the server's own clock, never the client's
+            self.last_pull_at = max(
+                (entry['updated_at'] for entry in changes),
+                key=datetime.fromisoformat
+            )
         except Exception as e:
             print(f"❌ Failed to pull from server: {str(e)}")
     
     def _get_user_id_from_token(self):
-        """Extract user ID from JWT token (mock version)"""
-        return 1  # Just a placeholder
+        """Return the user ID decoded from the JWT in set_auth_token"""
+        return self.user_id
     
     def _force_push(self, note):
         """Force push local version to server"""
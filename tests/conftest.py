@@ -0,0 +1,44 @@
+import itertools
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import fakeredis
+import pytest
+from flask_jwt_extended import create_access_token
+
+# The app modules live at the repository root and import each other flatly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    os.environ['DATABASE_URL'] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'notes.db'}"
+    import app as app_module
+    import models
+    app_module.redis_client = fakeredis.FakeRedis(decode_responses=True)
+    app_module.cache.init_app(app_module.app, config={'CACHE_TYPE': 'SimpleCache'})
+    # Hash passwords on threads; forking workers under pytest is slow
+    models.password_executor = ThreadPoolExecutor(max_workers=2)
+    with app_module.app.app_context():
+        models.init_db()
+    app_module.app._db_created = True
+    return app_module
+
+
+@pytest.fixture
+def client(app_module):
+    app_module.redis_client.flushall()
+    return app_module.app.test_client()
+
+
+_user_ids = itertools.count(1000)
+
+
+@pytest.fixture
+def auth(app_module):
+    """(user_id, headers) for a fresh user, so each test sees only its own notes"""
+    user_id = next(_user_ids)
+    with app_module.app.app_context():
+        token = create_access_token(identity=str(user_id))
+    return user_id, {'Authorization': f'Bearer {token}'}
@@ -0,0 +1,284 @@
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import create_engine, inspect, text
+from werkzeug.security import generate_password_hash
+
+import models
+
+
+def test_cached_jwt_required_miss_then_hit(app_module, client, monkeypatch):
+    with app_module.app.app_context():
+        token = create_access_token(identity='1')
+    headers = {'Authorization': f'Bearer {token}'}
+
+    # Miss: the token is verified and its identity cached until it expires
+    response = client.get('/api/notes/1', headers=headers)
+    assert response.status_code == 404
+    cache_keys = app_module.redis_client.keys('tok:*')
+    assert len(cache_keys) == 1
+    assert app_module.redis_client.get(cache_keys[0]) == '1'
+    assert app_module.redis_client.ttl(cache_keys[0]) > 0
+
+    # Hit: the identity comes from Redis without verifying the token again
+    def fail_verify(*args, **kwargs):
+        raise AssertionError('token verified on a cache hit')
+
+    monkeypatch.setattr(app_module, 'verify_jwt_in_request', fail_verify)
+    response = client.get('/api/notes/1', headers=headers)
+    assert response.status_code == 404
+
+
+def _create_note(client, headers, title, content='body', tags=None):
+    response = client.post(
+        '/api/notes',
+        json={'title': title, 'content': content, 'tags': tags or []},
+        headers=headers
+    )
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def test_notes_etag_answers_304_until_a_note_changes(client, auth):
+    _, headers = auth
+    note = _create_note(client, headers, 'First')
+
+    listing = client.get('/api/notes', headers=headers)
+    list_etag = listing.headers['ETag']
+    response = client.get('/api/notes', headers={**headers, 'If-None-Match': list_etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == list_etag
+
+    single = client.get(f"/api/notes/{note['id']}", headers=headers)
+    note_etag = single.headers['ETag']
+    response = client.get(
+        f"/api/notes/{note['id']}", headers={**headers, 'If-None-Match': note_etag}
+    )
+    assert response.status_code == 304
+
+    client.put(f"/api/notes/{note['id']}", json={'title': 'Edited'}, headers=headers)
+    response = client.get(
+        f"/api/notes/{note['id']}", headers={**headers, 'If-None-Match': note_etag}
+    )
+    assert response.status_code == 200
+    assert response.get_json()['title'] == 'Edited'
+    response = client.get('/api/notes', headers={**headers, 'If-None-Match': list_etag})
+    assert response.status_code == 200
+    assert [n['title'] for n in response.get_json()] == ['Edited']
+
+
+def test_notes_etag_changes_when_server_id_is_recorded(app_module, client, auth):
+    _, headers = auth
+    note = _create_note(client, headers, 'Draft')
+    etag = client.get('/api/notes', headers=headers).headers['ETag']
+
+    # set_server_ids deliberately leaves updated_at alone
+    with app_module.app.app_context():
+        app_module.LocalDB.set_server_ids({note['id']: 99})
+
+    response = client.get('/api/notes', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()[0]['server_id'] == 99
+
+
+def test_notes_etag_changes_after_delete_and_older_pulled_note(app_module, client, auth):
+    user_id, headers = auth
+    old = _create_note(client, headers, 'Old')
+    _create_note(client, headers, 'New')
+    etag = client.get('/api/notes', headers=headers).headers['ETag']
+
+    # Net effect on the live rows: same count, same max updated_at and version
+    client.delete(f"/api/notes/{old['id']}", headers=headers)
+    with app_module.app.app_context():
+        app_module.LocalDB.bulk_create_notes(user_id, [{
+            'id': 5000,
+            'title': 'Pulled',
+            'content': 'from the server',
+            'tags': [],
+            'created_at': '2000-01-01T00:00:00',
+            'updated_at': '2000-01-01T00:00:00',
+            'version': 1,
+        }])
+
+    response = client.get('/api/notes', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert {n['title'] for n in response.get_json()} == {'New', 'Pulled'}
+
+
+def _legacy_sqlite_engine(path):
+    """An SQLite database in the pre-upgrade shape: comma-separated tags, no extra indexes"""
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE notes (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+            "title VARCHAR(200) NOT NULL, content TEXT NOT NULL, tags VARCHAR(500), "
+            "created_at DATETIME, updated_at DATETIME, synced_at DATETIME, "
+            "version INTEGER, is_deleted BOOLEAN)"
+        ))
+        conn.execute(text(
+            "INSERT INTO notes (id, user_id, title, content, tags, version, is_deleted) "
+            "VALUES (1, 1, 'Groceries', 'milk and eggs', 'home, errands', 1, 0)"
+        ))
+        models.Tag.__table__.create(conn)
+        models.note_tags.create(conn)
+    return engine
+
+
+def _upgrade(engine):
+    with engine.begin() as conn:
+        models._upgrade_sqlite(conn)
+        models._create_missing_indexes(conn)
+
+
+def test_legacy_database_gets_new_indexes(tmp_path):
+    engine = _legacy_sqlite_engine(tmp_path / 'legacy.db')
+    _upgrade(engine)
+
+    index_names = {index['name'] for index in inspect(engine).get_indexes('notes')}
+    assert {
+        'ix_notes_user_active_updated', 'ix_notes_unsynced', 'ux_notes_user_server'
+    } <= index_names
+
+
+def test_notes_sharing_a_tag_link_to_one_row(app_module, client, auth):
+    _, headers = auth
+    _create_note(client, headers, 'First', tags=['work', 'ideas'])
+    _create_note(client, headers, 'Second', tags=['work '])
+
+    with app_module.app.app_context():
+        assert models.Tag.query.filter_by(name='work').count() == 1
+        tag_id = models.Tag.query.filter_by(name='work').one().id
+        links = models.db.session.execute(
+            models.note_tags.select().where(models.note_tags.c.tag_id == tag_id)
+        ).all()
+    assert len(links) == 2
+
+
+def test_legacy_comma_separated_tags_are_migrated(tmp_path):
+    engine = _legacy_sqlite_engine(tmp_path / 'legacy.db')
+    _upgrade(engine)
+    _upgrade(engine)  # Idempotent on an already-upgraded database
+
+    with engine.connect() as conn:
+        names = conn.execute(text(
+            "SELECT tags.name FROM tags "
+            "JOIN note_tags ON note_tags.tag_id = tags.id WHERE note_tags.note_id = 1"
+        )).scalars().all()
+    assert sorted(names) == ['errands', 'home']
+
+
+def test_logout_revokes_the_token(app_module, client, auth):
+    _, headers = auth
+    # Cache the identity first, so the revocation must win over a cache hit
+    assert client.get('/api/notes/1', headers=headers).status_code == 404
+
+    response = client.post('/api/logout', headers=headers)
+    assert response.status_code == 200
+    assert app_module.redis_client.keys('tok:*') == []
+    revoked_keys = app_module.redis_client.keys('rev:*')
+    assert len(revoked_keys) == 1
+    assert app_module.redis_client.ttl(revoked_keys[0]) > 0
+
+    response = client.get('/api/notes/1', headers=headers)
+    assert response.status_code == 401
+    assert app_module.redis_client.keys('tok:*') == []
+
+
+class _BrokenPool:
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool('worker died')
+
+    def shutdown(self, wait=True):
+        self.shut_down = True
+
+
+def test_broken_password_pool_is_replaced(app_module, client, monkeypatch):
+    broken = _BrokenPool()
+    monkeypatch.setattr(models, 'password_executor', broken)
+    monkeypatch.setattr(models, 'ProcessPoolExecutor', ThreadPoolExecutor)
+
+    # The failed call hashes inline, so the request still succeeds
+    response = client.post(
+        '/api/register',
+        json={'email': 'broken-pool@example.com', 'password': 'hunter22'}
+    )
+    assert response.status_code == 201
+    assert broken.shut_down
+    assert isinstance(models.password_executor, ThreadPoolExecutor)
+
+    response = client.post(
+        '/api/login',
+        json={'email': 'broken-pool@example.com', 'password': 'hunter22'}
+    )
+    assert response.status_code == 200
+
+
+def test_mark_synced_skips_notes_edited_during_the_push(app_module, client, auth):
+    user_id, headers = auth
+    note = _create_note(client, headers, 'Draft')
+    # Edited after version 1 was read for the push
+    client.put(f"/api/notes/{note['id']}", json={'title': 'Edited'}, headers=headers)
+
+    LocalDB = app_module.LocalDB
+    with app_module.app.app_context():
+        LocalDB.mark_synced([(note['id'], 1)])
+        unsynced = LocalDB.get_unsynced_notes(user_id)
+        assert [(n['id'], n['version']) for n in unsynced] == [(note['id'], 2)]
+
+        LocalDB.mark_synced([(note['id'], 2)])
+        assert LocalDB.get_unsynced_notes(user_id) == []
+
+
+def test_login_upgrades_legacy_werkzeug_hash(app_module, client):
+    with app_module.app.app_context():
+        user = models.User(
+            email='legacy@example.com',
+            password_hash=generate_password_hash('old-secret', method='pbkdf2:sha256')
+        )
+        models.db.session.add(user)
+        models.db.session.commit()
+
+    response = client.post(
+        '/api/login', json={'email': 'legacy@example.com', 'password': 'wrong'}
+    )
+    assert response.status_code == 401
+    with app_module.app.app_context():
+        user = models.User.query.filter_by(email='legacy@example.com').one()
+        assert user.password_hash.startswith('pbkdf2:')
+
+    response = client.post(
+        '/api/login', json={'email': 'legacy@example.com', 'password': 'old-secret'}
+    )
+    assert response.status_code == 200
+    with app_module.app.app_context():
+        user = models.User.query.filter_by(email='legacy@example.com').one()
+        assert user.password_hash.startswith('$argon2')
+        assert user.check_password('old-secret')
+
+
+def test_fts_index_follows_title_and_content_edits(app_module, client, auth):
+    _, headers = auth
+    note = _create_note(client, headers, 'Quarterly budget', content='spreadsheet')
+
+    def search(term):
+        response = client.get('/api/notes', query_string={'search': term}, headers=headers)
+        return [n['id'] for n in response.get_json()]
+
+    assert search('quarterly') == [note['id']]
+    assert search('spread') == [note['id']]
+
+    client.put(f"/api/notes/{note['id']}", json={'title': 'Annual plan'}, headers=headers)
+    assert search('quarterly') == []
+    assert search('annual') == [note['id']]
+
+    client.put(f"/api/notes/{note['id']}", json={'content': 'whiteboard'}, headers=headers)
+    assert search('spreadsheet') == []
+    assert search('whiteboard') == [note['id']]
+
+    # Sync bookkeeping updates must not rewrite the index
+    with app_module.app.app_context():
+        trigger_sql = models.db.session.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'notes_fts_au'"
+        )).scalar_one()
+    assert 'AFTER UPDATE OF title, content' in trigger_sql
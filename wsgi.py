@@ -0,0 +1,6 @@
+# Gunicorn entry point. Patch blocking I/O before anything imports it:
+#   gunicorn -k gevent -w $(nproc) --worker-connections 1000 -b 0.0.0.0:5000 wsgi:app
+from gevent import monkey
+monkey.patch_all()
+
+from app import app  # noqa: E402